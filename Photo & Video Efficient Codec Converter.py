@@ -1,22 +1,113 @@
 import argparse
+import atexit
+import ctypes
+import ctypes.util
+import hashlib
+import json
 import os
+import re
 import sys
 import subprocess
 import shutil
 import tempfile
+import time
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 平台原生的内核级复制：macOS 的 copyfile（APFS 上可克隆），Windows 的 CopyFile2（Windows 8+）
+libc_copyfile = None
+win_copyfile2 = None
+if sys.platform == "darwin":
+    try:
+        libc_copyfile = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).copyfile
+        libc_copyfile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_uint32]
+        libc_copyfile.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        libc_copyfile = None
+elif sys.platform == "win32":
+    try:
+        win_copyfile2 = ctypes.windll.kernel32.CopyFile2
+        win_copyfile2.argtypes = [ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_void_p]
+        win_copyfile2.restype = ctypes.c_long  # HRESULT，负数表示失败
+    except AttributeError:  # Windows 7 及更早版本
+        win_copyfile2 = None
+
+# 可选依赖：pillow-heif 在进程内编码 HEIC，rawpy 解码相机 RAW
+try:
+    import pillow_heif
+    from PIL import Image, ImageOps
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
+
+try:
+    import rawpy
+except ImportError:
+    rawpy = None
+
+# 可选依赖：Wand（ImageMagick 的 Python 绑定），在进程内调用 MagickWand 库，无需每张图片启动 magick
+try:
+    from wand.image import Image as WandImage
+    from wand.version import formats as wand_formats
+except ImportError:  # 未安装 Wand 或找不到 MagickWand 动态库
+    WandImage = None
 
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".gif", ".webp", ".jp2", ".nef", ".cr2", ".arw", ".raf"}
+RAW_EXTS = {".nef", ".cr2", ".arw", ".raf"}
 VIDEO_EXTS = {".mp4", ".mov", ".m4v", ".mkv", ".avi", ".wmv", ".mts", ".m2ts", ".flv", ".webm"}
 
+# 文件类别：遍历目录时按扩展名查表一次，之后直接比较整数
+KIND_OTHER = 0
+KIND_IMAGE = 1
+KIND_VIDEO = 2
+EXT_KIND: dict[str, int] = {e: KIND_IMAGE for e in IMAGE_EXTS} | {e: KIND_VIDEO for e in VIDEO_EXTS}
 
-def is_image(path: Path) -> bool:
-    return path.suffix.lower() in IMAGE_EXTS
+# 硬件 HEVC 编码器，按自动检测时的优先顺序排列
+HW_ENCODERS = {"nvenc": "hevc_nvenc", "qsv": "hevc_qsv", "amf": "hevc_amf", "vaapi": "hevc_vaapi"}
+HWACCEL_CHOICES = ["auto", *HW_ENCODERS, "none"]
+VAAPI_DEVICE = "/dev/dri/renderD128"
+# 批量转换图片时单条命令包含的文件数上限（受命令行长度与 ffmpeg 同时打开的输入数限制）
+MAGICK_BATCH_SIZE = 100
+FFMPEG_BATCH_SIZE = 16
+# ffprobe 不可用时解析 ffmpeg -i 输出所用的正则
+RE_DURATION = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+RE_VIDEO_CODEC = re.compile(r'Video:\s*(\w+)')
+# heif-enc --list-encoders 输出中的编码器行，如 "- kvazaar = kvazaar HEVC encoder (2.2.0)"
+RE_HEIF_ENCODER = re.compile(r'^-\s*(\S+)\s*=')
+# 内容指纹缓存文件（位于输出目录）及其格式版本，以及计算指纹时读取的文件头长度
+CACHE_FILE = ".converter_cache.json"
+CACHE_VERSION = 2
+HASH_PREFIX_BYTES = 1 << 20
+# 进度条最短刷新间隔（秒）
+PROGRESS_INTERVAL = 0.1
+# --dry-run 估算耗时时试编码的视频秒数
+SAMPLE_ENCODE_SEC = 5
+# Linux ioctl：在 btrfs/XFS 等文件系统上创建共享数据块的 reflink 副本
+FICLONE = 0x40049409
+# --also-thumb 生成的 JPEG 缩略图：最大宽度与文件名后缀
+THUMB_WIDTH = 320
+THUMB_SUFFIX = "_thumb.jpg"
+# macOS copyfile 标志：尽量创建 APFS 克隆，不支持时自动退回普通复制（含 EXCL 语义，目标不能已存在）
+COPYFILE_CLONE = 1 << 24
+# x265 预设到各硬件编码器预设的映射
+NVENC_PRESETS = {"ultrafast": "p1", "superfast": "p1", "veryfast": "p2", "faster": "p3", "fast": "p4", "medium": "p5", "slow": "p6", "slower": "p7", "veryslow": "p7"}
+QSV_PRESETS = {"ultrafast": "veryfast", "superfast": "veryfast"}
+AMF_QUALITY = {"ultrafast": "speed", "superfast": "speed", "veryfast": "speed", "faster": "speed", "fast": "balanced", "medium": "balanced", "slow": "quality", "slower": "quality", "veryslow": "quality"}
 
 
-def is_video(path: Path) -> bool:
-    return path.suffix.lower() in VIDEO_EXTS
+class SourceFile(NamedTuple):
+    """待处理的源文件、文件类别 (KIND_*) 及遍历目录时取得的 stat 结果"""
+    path: Path
+    kind: int
+    stat: os.stat_result
 
 
 def run_cmd(cmd: list[str]) -> int:
@@ -31,14 +122,26 @@ def run_cmd(cmd: list[str]) -> int:
         return 127
 
 
-def cmd_output(cmd: list[str]) -> tuple[int, str, str]:
+def cmd_output(cmd: list[str], capture_stdout: bool = True, capture_stderr: bool = True) -> tuple[int, str, str]:
+    # 只捕获需要的输出流，其余丢弃；以字节读取，结束后统一按 UTF-8 解码一次
     try:
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return proc.returncode, proc.stdout, proc.stderr
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE if capture_stderr else subprocess.DEVNULL,
+        )
+        out = proc.stdout.decode("utf-8", errors="replace") if proc.stdout else ""
+        err = proc.stderr.decode("utf-8", errors="replace") if proc.stderr else ""
+        return proc.returncode, out, err
     except FileNotFoundError:
         return 127, "", f"Command not found: {cmd[0]}"
 
 
+def default_jobs() -> int:
+    # 每个 ffmpeg 任务大约占用 4 个线程，按此估算可并行的文件数
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
 def ensure_tool_available(name: str, fallback_path: str | None = None) -> bool:
     if fallback_path:
         try:
@@ -48,24 +151,105 @@ def ensure_tool_available(name: str, fallback_path: str | None = None) -> bool:
     return shutil.which(name) is not None
 
 
-def copy_image_exif(source: Path, target: Path) -> bool:
-    """使用 exiftool 复制图片的 EXIF 元数据"""
-    exiftool_bin = os.environ.get("EXIFTOOL_PATH", "exiftool")
+class ExifToolDaemon:
+    """常驻的 exiftool 进程（-stay_open），避免每个文件都重新启动 Perl 解释器"""
+
+    def __init__(self, exiftool_bin: str = "exiftool"):
+        self.exiftool_bin = exiftool_bin
+        self.proc: subprocess.Popen | None = None
+
+    def start(self) -> bool:
+        if self.proc is not None and self.proc.poll() is None:
+            return True
+        try:
+            # 通过 stdin 逐行读取参数，每遇到 -execute 执行一次并输出 {ready}
+            self.proc = subprocess.Popen(
+                [self.exiftool_bin, "-stay_open", "True", "-@", "-", "-common_args", "-charset", "filename=utf8"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+            )
+        except OSError:
+            self.proc = None
+            return False
+        return True
+
+    def execute(self, *cmd_args: str) -> tuple[bool, str]:
+        if not self.start():
+            return False, f"Command not found: {self.exiftool_bin}"
+        lines: list[str] = []
+        try:
+            self.proc.stdin.write("\n".join(cmd_args) + "\n-execute\n")
+            self.proc.stdin.flush()
+            for line in self.proc.stdout:
+                if line.strip() == "{ready}":
+                    break
+                lines.append(line)
+            else:
+                # 未读到 {ready} 即 EOF，说明 exiftool 已退出
+                self.proc = None
+                return False, "".join(lines)
+        except OSError as e:
+            self.close()
+            return False, str(e)
+        ok = not any(line.startswith("Error") for line in lines)
+        return ok, "".join(lines)
+
+    def close(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.write("-stay_open\nFalse\n")
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+        self.proc = None
+
+
+# 每个进程各自持有一个 exiftool 常驻进程；子进程退出时 stdin 关闭，exiftool 随之退出
+_exiftool_daemons: dict[str, ExifToolDaemon] = {}
+
+
+def get_exiftool_daemon(exiftool_bin: str) -> ExifToolDaemon:
+    daemon = _exiftool_daemons.get(exiftool_bin)
+    if daemon is None:
+        daemon = ExifToolDaemon(exiftool_bin)
+        _exiftool_daemons[exiftool_bin] = daemon
+    return daemon
+
+
+@atexit.register
+def close_exiftool_daemons() -> None:
+    for daemon in _exiftool_daemons.values():
+        daemon.close()
+    _exiftool_daemons.clear()
+
+
+def copy_image_exif(source: Path, target: Path, exiftool_bin: str = "", keep_orientation: bool = True) -> bool:
+    """使用 exiftool 复制图片的 EXIF 元数据；像素已按方向旋转时设 keep_orientation=False 以免重复旋转"""
+    exiftool_bin = exiftool_bin or os.environ.get("EXIFTOOL_PATH", "exiftool")
     if not ensure_tool_available("exiftool", exiftool_bin if exiftool_bin != "exiftool" else None):
         print("[WARN] exiftool not found in PATH; skipping EXIF copy.")
         return False
-    
-    copy_cmd = [
-        exiftool_bin,
+
+    exif_args = [
         "-overwrite_original",
+        "-fast",  # 不扫描文件尾部的附加数据，读取更快
         "-TagsFromFile", str(source),
         "-all:all",
         "-unsafe",
         "-icc_profile",
-        str(target)
     ]
-    code = run_cmd(copy_cmd)
-    return code == 0
+    if not keep_orientation:
+        exif_args.append("--Orientation")
+    ok, out = get_exiftool_daemon(exiftool_bin).execute(*exif_args, str(target))
+    if not ok:
+        print(f"[CMD-ERR] exiftool failed: {target}\n{out.strip()}", file=sys.stderr)
+    return ok
 
 
 def copy_video_metadata(source: Path, target: Path, ffmpeg_bin: str = "ffmpeg") -> bool:
@@ -106,6 +290,56 @@ def copy_video_metadata(source: Path, target: Path, ffmpeg_bin: str = "ffmpeg")
         return False
 
 
+def fast_copy(src: Path, dst: Path) -> None:
+    """复制出独立的文件（可单独修改时间）：reflink/克隆 > 内核复制 > shutil.copy2"""
+    if libc_copyfile is not None:
+        try:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            if libc_copyfile(os.fsencode(src), os.fsencode(dst), None, COPYFILE_CLONE) == 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError:
+            pass
+    elif win_copyfile2 is not None:
+        # 第三个参数为 NULL 时使用默认选项（覆盖已有目标）
+        try:
+            if win_copyfile2(str(src), str(dst), None) >= 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError:
+            pass
+    elif fcntl is not None and hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                except OSError:
+                    # 不支持 reflink 时由内核直接复制，避免数据经过用户态
+                    remaining = os.fstat(fsrc.fileno()).st_size
+                    while remaining > 0:
+                        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                        if n == 0:
+                            break
+                        remaining -= n
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def fast_dup(src: Path, dst: Path) -> None:
+    """尽量不写入数据地复制文件：硬链接 > fast_copy"""
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        # 跨盘符/跨文件系统或文件系统不支持硬链接
+        pass
+    fast_copy(src, dst)
+
+
 def set_mtime_like_source(source: Path, target: Path) -> None:
     try:
         stat = source.stat()
@@ -115,19 +349,222 @@ def set_mtime_like_source(source: Path, target: Path) -> None:
 
 
 def ffmpeg_supports_heic(ffmpeg_bin: str) -> bool:
-    code, out, err = cmd_output([ffmpeg_bin, "-hide_banner", "-muxers"])
+    code, out, _ = cmd_output([ffmpeg_bin, "-hide_banner", "-muxers"], capture_stderr=False)
     if code != 0:
         return False
     return "heic" in out.lower()
 
 
-def convert_image_to_heic(src: Path, dst: Path, quality: int = 30, preset: str = "medium", ffmpeg_bin: str = "ffmpeg", magick_bin: str = "magick") -> tuple[bool, str]:
-    # 优先使用指定或默认的 magick_bin -> heif-enc -> ffmpeg
+@lru_cache(maxsize=None)
+def pillow_heif_encoders() -> tuple[str, ...]:
+    """pillow-heif 所带 libheif 中可用的编码器插件 id"""
+    if pillow_heif is None:
+        return ()
+    try:
+        # mask 为 alpha 蒙版编码器，不能用于 HEIC 主图
+        return tuple(e for e in pillow_heif.libheif_info().get("encoders", {}) if e != "mask")
+    except Exception:
+        return ()
+
+
+@lru_cache(maxsize=None)
+def heif_enc_encoders() -> tuple[str, ...]:
+    """heif-enc 可用的 HEIC 编码器插件 id（解析 heif-enc --list-encoders）"""
+    if not ensure_tool_available("heif-enc"):
+        return ()
+    code, out, _ = cmd_output(["heif-enc", "--list-encoders"], capture_stderr=False)
+    if code != 0:
+        return ()
+    encoders: list[str] = []
+    in_heic = False
+    for line in out.splitlines():
+        line = line.strip()
+        if line.endswith(":"):
+            # 只取 "HEIC encoders:" 段落，跳过 AVIF 等其他格式的编码器
+            in_heic = line.upper().startswith("HEIC")
+            continue
+        m = RE_HEIF_ENCODER.match(line)
+        if in_heic and m:
+            encoders.append(m.group(1))
+    return tuple(encoders)
+
+
+def resolve_heif_encoder(requested: str) -> str:
+    """校验 --heif-encoder，所选插件在 pillow-heif 与 heif-enc 中都不存在时回退到 libheif 默认编码器"""
+    if not requested:
+        return ""
+    available = dict.fromkeys(pillow_heif_encoders() + heif_enc_encoders())
+    if requested in available:
+        return requested
+    listed = ", ".join(available) or "无"
+    print(f"[WARN] 未找到 HEIC 编码器插件 {requested}（可用: {listed}），使用默认编码器。")
+    return ""
+
+
+def save_thumbnail_pil(img, thumb: Path) -> None:
+    """从已解码的 PIL 图像生成 JPEG 缩略图，无需再次解码源文件"""
+    try:
+        # 缩略图不带 EXIF，需先按 Orientation 旋转像素，否则竖拍照片的缩略图会横过来
+        small = ImageOps.exif_transpose(img.copy())
+        small.thumbnail((THUMB_WIDTH, THUMB_WIDTH * 100))
+        small.convert("RGB").save(thumb, format="JPEG", quality=85)
+    except Exception as e:
+        print(f"[WARN] 缩略图生成失败: {thumb.name} ({e})")
+
+
+def make_thumbnail(src: Path, thumb: Path, ffmpeg_bin: str = "ffmpeg") -> bool:
+    """单独调用 ffmpeg 生成 JPEG 缩略图（编码后端无法顺带输出缩略图时使用）"""
+    cmd = [
+        ffmpeg_bin, "-y", "-v", "error",
+        # ffmpeg 将 JPEG 的 EXIF 方向导出为显示矩阵，autorotate 按其旋转像素（默认开启，此处显式指定）
+        "-autorotate",
+        "-i", str(src),
+        "-vf", f"scale='min({THUMB_WIDTH},iw)':-2",
+        "-frames:v", "1",
+        "-c:v", "mjpeg",
+        "-q:v", "3",
+        str(thumb)
+    ]
+    ok = run_cmd(cmd) == 0
+    if not ok:
+        print(f"[WARN] 缩略图生成失败: {thumb.name}")
+    return ok
+
+
+def ensure_thumbnail(src: Path, thumb: Path, ffmpeg_bin: str = "ffmpeg") -> None:
+    """HEIC 已是最新（跳过或复用缓存）时，为缺少缩略图的图片补生成缩略图"""
+    if lookup_output(thumb) is None and make_thumbnail(src, thumb, ffmpeg_bin):
+        set_mtime_like_source(src, thumb)
+        record_output(thumb)
+
+
+def encode_heic_inproc(src: Path, dst: Path, quality: int = 30, heif_encoder: str = "", thumb: Path | None = None) -> tuple[bool, str]:
+    """用 pillow-heif 在当前进程内编码 HEIC，省去每张图片启动外部程序的开销"""
+    q = max(10, min(95, 70 - (quality - 18)))
+    is_raw = src.suffix.lower() in RAW_EXTS
+    try:
+        # 仅在指定插件时设置；旧版 pillow-heif 没有 PREFERRED_ENCODER，此时只能使用默认编码器
+        if heif_encoder and hasattr(pillow_heif.options, "PREFERRED_ENCODER"):
+            pillow_heif.options.PREFERRED_ENCODER["HEIF"] = heif_encoder
+        if is_raw:
+            # RAW 由 rawpy 解码为 RGB 数组；元数据不会随像素带过来，需要之后用 exiftool 复制
+            with rawpy.imread(str(src)) as raw:
+                img = Image.fromarray(raw.postprocess(use_camera_wb=True))
+            img.save(dst, format="HEIF", quality=q)
+            if thumb is not None:
+                save_thumbnail_pil(img, thumb)
+            return True, "rawpy"
+        with Image.open(src) as img:
+            # EXIF / XMP / ICC 保存在 img.info 中，pillow-heif 保存时会一并写入
+            if img.mode == "F":
+                # 浮点图像的数值范围无法确定，交给外部工具处理
+                raise ValueError("unsupported mode F")
+            if img.mode == "I" or img.mode.startswith("I;16"):
+                # 16 位灰度直接 convert 会把超过 255 的值截断成纯白，先按比例缩放到 8 位
+                img = img.convert("I").point(lambda v: v * (1 / 256)).convert("L")
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+            img.save(dst, format="HEIF", quality=q)
+            if thumb is not None:
+                save_thumbnail_pil(img, thumb)
+        return True, "pillow"
+    except Exception as e:
+        print(f"[WARN] pillow-heif 编码失败，改用外部工具: {src.name} ({e})")
+        try:
+            if dst.exists():
+                dst.unlink()
+        except Exception:
+            pass
+        return False, "none"
+
+
+@lru_cache(maxsize=None)
+def wand_supports_heic() -> bool:
+    """Wand 可用且所链接的 ImageMagick 带有 HEIC 编码支持"""
+    if WandImage is None:
+        return False
+    try:
+        return bool(wand_formats("HEIC"))
+    except Exception:
+        return False
+
+
+def magick_encode_heic(src: Path, dst: Path, quality: int = 30, thumb: Path | None = None) -> bool:
+    """通过 Wand 在当前进程内用 ImageMagick 编码 HEIC，与 magick 命令一样保留 EXIF"""
+    q = max(10, min(95, 70 - (quality - 18)))
+    try:
+        with WandImage(filename=str(src)) as img:
+            if thumb is not None:
+                # 复用已解码的图像生成缩略图
+                try:
+                    with img.clone() as small:
+                        # 缩略图不带 EXIF，先按 Orientation 旋转像素
+                        small.auto_orient()
+                        if small.width > THUMB_WIDTH:
+                            small.resize(THUMB_WIDTH, max(1, round(small.height * THUMB_WIDTH / small.width)))
+                        small.format = "jpeg"
+                        small.save(filename=str(thumb))
+                except Exception as e:
+                    print(f"[WARN] 缩略图生成失败: {thumb.name} ({e})")
+            img.compression_quality = q
+            img.options["heic:speed"] = "5"
+            img.format = "heic"
+            img.save(filename=str(dst))
+        return True
+    except Exception as e:
+        print(f"[WARN] Wand 编码失败，改用外部工具: {src.name} ({e})")
+        try:
+            if dst.exists():
+                dst.unlink()
+        except Exception:
+            pass
+        return False
+
+
+def inproc_heic_available() -> bool:
+    """是否可以在进程内编码 HEIC（pillow-heif 或 Wand）"""
+    return pillow_heif is not None or wand_supports_heic()
+
+
+def heif_enc_encode(src: Path, dst: Path, quality: int = 30, preset: str = "medium", heif_encoder: str = "") -> bool:
+    """调用 heif-enc 编码单张图片，可用 -e 指定编码器插件"""
+    q = max(10, min(95, 70 - (quality - 18)))
+    cmd = ["heif-enc", "-q", str(q)]
+    if heif_encoder:
+        cmd += ["-e", heif_encoder]
+        if heif_encoder == "x265":
+            cmd += ["-p", f"preset={preset}"]
+    cmd += [str(src), "-o", str(dst)]
+    return run_cmd(cmd) == 0
+
+
+def convert_image_to_heic(src: Path, dst: Path, quality: int = 30, preset: str = "medium", ffmpeg_bin: str = "ffmpeg", magick_bin: str = "magick", heif_encoder: str = "", thumb: Path | None = None) -> tuple[bool, str]:
+    """转换单张图片为 HEIC；指定 thumb 时同时输出 JPEG 缩略图，尽量只解码一次源图片"""
+    # 已安装 pillow-heif 时优先在进程内编码（RAW 还需要 rawpy）；指定了编码器插件时需其 libheif 带有该插件
+    if pillow_heif is not None and (rawpy is not None or src.suffix.lower() not in RAW_EXTS) \
+            and (not heif_encoder or heif_encoder in pillow_heif_encoders()):
+        ok, backend = encode_heic_inproc(src, dst, quality, heif_encoder, thumb)
+        if ok:
+            return ok, backend
+    # 指定的编码器插件只能通过 libheif 使用，magick / Wand 无法选择，故优先 heif-enc；
+    # heif-enc 无法读取 GIF/BMP/WebP/RAW 等格式，失败时继续按默认编码器走后面的回退链
+    if heif_encoder and heif_encoder in heif_enc_encoders():
+        if heif_enc_encode(src, dst, quality, preset, heif_encoder):
+            if thumb is not None:
+                make_thumbnail(src, thumb, ffmpeg_bin)
+            return True, "heif-enc"
+        print(f"[WARN] heif-enc ({heif_encoder}) 编码失败，改用默认编码器: {src.name}")
+    # 其次通过 Wand 在进程内调用 ImageMagick
+    if wand_supports_heic() and magick_encode_heic(src, dst, quality, thumb):
+        return True, "wand"
+    # 再次使用指定或默认的 magick_bin -> heif-enc -> ffmpeg
     if ensure_tool_available("magick", magick_bin if magick_bin != "magick" else None):
         q = max(10, min(95, 70 - (quality - 18)))
-        cmd = [
-            magick_bin,
-            str(src),
+        cmd = [magick_bin, str(src)]
+        if thumb is not None:
+            # 在括号内对解码后的图像副本缩放并写出缩略图，原图继续用于 HEIC 编码
+            cmd += ["(", "+clone", "-auto-orient", "-thumbnail", f"{THUMB_WIDTH}x>", "-write", str(thumb), "+delete", ")"]
+        cmd += [
             "-quality", str(q),
             "-define", "heic:speed=5",
             str(dst)
@@ -135,20 +572,26 @@ def convert_image_to_heic(src: Path, dst: Path, quality: int = 30, preset: str =
         ok = run_cmd(cmd) == 0
         return ok, "magick"
     if ensure_tool_available("heif-enc"):
-        q = max(10, min(95, 70 - (quality - 18)))
-        cmd = [
-            "heif-enc",
-            "-q", str(q),
-            str(src),
-            "-o", str(dst)
-        ]
-        ok = run_cmd(cmd) == 0
+        ok = heif_enc_encode(src, dst, quality, preset)
+        if ok and thumb is not None:
+            make_thumbnail(src, thumb, ffmpeg_bin)
         return ok, "heif-enc"
     if ffmpeg_supports_heic(ffmpeg_bin):
-        cmd = [
-            ffmpeg_bin, "-y",
-            "-i", str(src),
-            "-vf", "format=yuv420p",
+        cmd = [ffmpeg_bin, "-y"]
+        if thumb is not None:
+            # 与 make_thumbnail 相同，按 EXIF 方向旋转后再 split，缩略图与 HEIC 方向一致
+            cmd.append("-autorotate")
+        cmd += ["-i", str(src)]
+        if thumb is not None:
+            # 一次解码，split 为两路：一路缩放后编码为 JPEG 缩略图，另一路编码为 HEIC
+            cmd += [
+                "-filter_complex", f"[0:v]split=2[a][b];[a]scale='min({THUMB_WIDTH},iw)':-2[t];[b]format=yuv420p[h]",
+                "-map", "[t]", "-frames:v", "1", "-c:v", "mjpeg", "-q:v", "3", str(thumb),
+                "-map", "[h]"
+            ]
+        else:
+            cmd += ["-vf", "format=yuv420p"]
+        cmd += [
             "-c:v", "libx265",
             "-preset", preset,
             "-crf", str(quality),
@@ -162,28 +605,183 @@ def convert_image_to_heic(src: Path, dst: Path, quality: int = 30, preset: str =
     return False, "none"
 
 
-def is_video_h265(src: Path, ffmpeg_bin: str = "ffmpeg") -> bool:
-    """检测视频是否已经是 H.265/HEVC 编码"""
-    probe_cmd = [ffmpeg_bin, "-i", str(src)]
-    code, _, err = cmd_output(probe_cmd)
-    # 查找视频流编码信息
-    for line in err.split('\n'):
-        if 'Video:' in line:
-            # 检查是否包含 hevc 或 h265 关键词
-            line_lower = line.lower()
-            if 'hevc' in line_lower or 'h265' in line_lower:
-                return True
-    return False
+def convert_images_to_heic(srcs: list[Path], out_dir: Path, quality: int = 30, preset: str = "medium", ffmpeg_bin: str = "ffmpeg", magick_bin: str = "magick") -> tuple[str, set[Path]]:
+    """用一条命令批量转换多张图片，输出为 out_dir/<文件名>.heic；返回 (使用的后端, 命令执行失败的批次中的图片)，无法批量时后端为 none"""
+    failed: set[Path] = set()
+    if ensure_tool_available("magick", magick_bin if magick_bin != "magick" else None):
+        q = max(10, min(95, 70 - (quality - 18)))
+        for i in range(0, len(srcs), MAGICK_BATCH_SIZE):
+            cmd = [
+                magick_bin, "mogrify",
+                "-path", str(out_dir),
+                "-format", "heic",
+                "-quality", str(q),
+                "-define", "heic:speed=5",
+                *[str(src) for src in srcs[i:i + MAGICK_BATCH_SIZE]]
+            ]
+            if run_cmd(cmd) != 0:
+                # 非零退出时无法确定哪些输出完整，整批都视为失败
+                failed.update(srcs[i:i + MAGICK_BATCH_SIZE])
+        return "magick", failed
+    # heif-enc 每次只能输出一个文件，交由逐个转换处理
+    if ensure_tool_available("heif-enc"):
+        return "none", failed
+    if ffmpeg_supports_heic(ffmpeg_bin):
+        # 多个 -i 输入，每个输入映射到各自的输出文件，只启动一次 ffmpeg
+        for i in range(0, len(srcs), FFMPEG_BATCH_SIZE):
+            chunk = srcs[i:i + FFMPEG_BATCH_SIZE]
+            cmd = [ffmpeg_bin, "-y"]
+            for src in chunk:
+                cmd += ["-i", str(src)]
+            for j, src in enumerate(chunk):
+                cmd += [
+                    "-map", f"{j}:v:0",
+                    "-vf", "format=yuv420p",
+                    "-c:v", "libx265",
+                    "-preset", preset,
+                    "-crf", str(quality),
+                    "-tag:v", "hvc1",
+                    "-f", "heic",
+                    str(out_dir / (src.stem + ".heic"))
+                ]
+            if run_cmd(cmd) != 0:
+                failed.update(chunk)
+        return "ffmpeg", failed
+    return "none", failed
+
+
+def ffprobe_path_for(ffmpeg_bin: str) -> str:
+    """根据 ffmpeg 路径推断同目录下的 ffprobe"""
+    p = Path(ffmpeg_bin)
+    if p.parent == Path(".") or "ffmpeg" not in p.name.lower():
+        return "ffprobe"
+    return str(p.with_name(p.name.lower().replace("ffmpeg", "ffprobe")))
+
 
+def probe_video_ffmpeg(src: Path, ffmpeg_bin: str = "ffmpeg") -> tuple[str | None, float | None]:
+    """ffprobe 不可用时，解析 ffmpeg -i 的输出获取编码与时长"""
+    code, _, err = cmd_output([ffmpeg_bin, "-i", str(src)], capture_stdout=False)
+    codec_match = RE_VIDEO_CODEC.search(err)
+    codec_name = codec_match.group(1).lower() if codec_match else None
+    duration_match = RE_DURATION.search(err)
+    duration_sec = None
+    if duration_match:
+        h, m, s = duration_match.groups()
+        duration_sec = int(h) * 3600 + int(m) * 60 + float(s)
+    return codec_name, duration_sec
+
+
+# 探测结果缓存：(路径, mtime, 大小) -> (视频编码, 时长)
+_probe_cache: dict[tuple[str, float, int], tuple[str | None, float | None]] = {}
 
-def convert_video_to_h265(src: Path, dst: Path, crf: int = 23, preset: str = "medium", ffmpeg_bin: str = "ffmpeg", skip_h265: bool = True) -> bool:
+
+def probe_video(src: Path, ffmpeg_bin: str = "ffmpeg") -> tuple[str | None, float | None]:
+    """使用一次 ffprobe 同时获取视频编码名称与时长（秒）"""
+    try:
+        st = src.stat()
+        key = (str(src), st.st_mtime, st.st_size)
+    except OSError:
+        key = None
+    if key is not None and key in _probe_cache:
+        return _probe_cache[key]
+
+    cmd = [
+        ffprobe_path_for(ffmpeg_bin),
+        "-v", "error",
+        "-print_format", "json",
+        "-show_streams",
+        "-show_format",
+        str(src)
+    ]
+    code, out, _ = cmd_output(cmd, capture_stderr=False)
+    if code == 127:
+        result = probe_video_ffmpeg(src, ffmpeg_bin)
+    else:
+        codec_name = None
+        duration_sec = None
+        try:
+            info = json.loads(out or "{}")
+        except json.JSONDecodeError:
+            info = {}
+        for stream in info.get("streams", []):
+            if stream.get("codec_type") == "video":
+                codec_name = (stream.get("codec_name") or "").lower() or None
+                break
+        try:
+            duration_sec = float(info.get("format", {}).get("duration"))
+        except (TypeError, ValueError):
+            pass
+        result = (codec_name, duration_sec)
+
+    if key is not None:
+        _probe_cache[key] = result
+    return result
+
+
+def video_encoder_args(hwaccel: str, crf: int, preset: str, threads: int = 0) -> tuple[list[str], list[str]]:
+    """返回 (放在 -i 之前的设备参数, 视频编码参数)"""
+    if hwaccel == "nvenc":
+        return [], ["-c:v", "hevc_nvenc", "-preset", NVENC_PRESETS.get(preset, "p5"), "-rc", "vbr", "-cq", str(crf), "-b:v", "0"]
+    if hwaccel == "qsv":
+        # 软件解码后上传到 QSV 显存，兼容 QSV 无法硬解的输入格式
+        return (
+            ["-init_hw_device", "qsv=hw", "-filter_hw_device", "hw"],
+            ["-vf", "format=nv12,hwupload=extra_hw_frames=64,format=qsv", "-c:v", "hevc_qsv", "-preset", QSV_PRESETS.get(preset, preset), "-global_quality", str(crf)],
+        )
+    if hwaccel == "vaapi":
+        return ["-vaapi_device", VAAPI_DEVICE], ["-vf", "format=nv12,hwupload", "-c:v", "hevc_vaapi", "-qp", str(crf)]
+    if hwaccel == "amf":
+        return [], ["-c:v", "hevc_amf", "-quality", AMF_QUALITY.get(preset, "balanced"), "-rc", "cqp", "-qp_i", str(crf), "-qp_p", str(crf)]
+    enc_args = ["-c:v", "libx265", "-crf", str(crf), "-preset", preset]
+    if threads > 0:
+        # 线程池大小与 -threads 一致；WPP（按 CTU 行并行）几乎不影响画质，
+        # 帧级并行（frame-threads）会略微降低率失真性能，因此限制在 4 以内
+        enc_args += ["-x265-params", f"pools={threads}:wpp=1:frame-threads={min(4, threads)}"]
+    return [], enc_args
+
+
+def hw_encoder_works(ffmpeg_bin: str, hwaccel: str) -> bool:
+    """用一段极短的测试画面试编码，确认驱动与设备确实可用"""
+    pre_args, enc_args = video_encoder_args(hwaccel, 23, "medium")
+    cmd = [
+        ffmpeg_bin, "-hide_banner", "-v", "error",
+        *pre_args,
+        "-f", "lavfi",
+        "-i", "color=black:s=256x256:d=0.2",
+        *enc_args,
+        "-f", "null", "-"
+    ]
+    code, _, _ = cmd_output(cmd, capture_stdout=False, capture_stderr=False)
+    return code == 0
+
+
+def resolve_hwaccel(ffmpeg_bin: str, requested: str) -> str:
+    """将 --hwaccel 解析为实际可用的编码方式，不可用时回退到 CPU (libx265)"""
+    if requested == "none":
+        return "none"
+    code, out, _ = cmd_output([ffmpeg_bin, "-hide_banner", "-encoders"], capture_stderr=False)
+    listed = out if code == 0 else ""
+    candidates = list(HW_ENCODERS) if requested == "auto" else [requested]
+    for hwaccel in candidates:
+        if hwaccel == "vaapi" and not Path(VAAPI_DEVICE).exists():
+            continue
+        if HW_ENCODERS[hwaccel] in listed and hw_encoder_works(ffmpeg_bin, hwaccel):
+            return hwaccel
+    if requested != "auto":
+        print(f"[WARN] 硬件编码器 {HW_ENCODERS[requested]} 不可用，回退到 libx265。")
+    return "none"
+
+
+def convert_video_to_h265(src: Path, dst: Path, crf: int = 23, preset: str = "medium", ffmpeg_bin: str = "ffmpeg", skip_h265: bool = True, threads: int = 0, show_progress: bool = True, hwaccel: str = "none") -> bool:
+    # 一次探测同时得到编码与时长
+    codec_name, duration_sec = probe_video(src, ffmpeg_bin)
     # 检测是否已经是 H.265
-    if is_video_h265(src, ffmpeg_bin):
+    if codec_name in ("hevc", "h265"):
         if skip_h265:
             print(f"[INFO] 视频已是 H.265 编码，跳过转换: {src.name}")
-            # 直接复制文件
+            # 直接复制文件（优先硬链接/reflink）
             try:
-                shutil.copy2(src, dst)
+                fast_dup(src, dst)
                 return True
             except Exception as e:
                 print(f"[ERR] 复制失败: {e}")
@@ -193,127 +791,392 @@ def convert_video_to_h265(src: Path, dst: Path, crf: int = 23, preset: str = "me
                 response = input(f"[?] 视频 {src.name} 已是 H.265，是否跳过？(Y/n，默认跳过): ").strip().lower()
                 if not response or response.startswith('y'):
                     print(f"[INFO] 跳过 H.265 视频: {src.name}")
-                    shutil.copy2(src, dst)
+                    fast_dup(src, dst)
                     return True
             except EOFError:
                 print(f"[INFO] 跳过 H.265 视频: {src.name}")
-                shutil.copy2(src, dst)
+                fast_dup(src, dst)
                 return True
     
+    pre_args, enc_args = video_encoder_args(hwaccel, crf, preset, threads)
     cmd = [
         ffmpeg_bin, "-y",
         "-progress", "pipe:1",  # 输出进度到 stdout
+        *pre_args,
         "-i", str(src),
         "-map_metadata", "0",  # 复制所有元数据
         "-map_metadata:s:v", "0:s:v",  # 复制视频流元数据
         "-map_metadata:s:a", "0:s:a",  # 复制音频流元数据
-        "-c:v", "libx265",
-        "-crf", str(crf),
-        "-preset", preset,
+        *enc_args,
         "-tag:v", "hvc1",
         "-c:a", "copy",
         "-movflags", "use_metadata_tags",  # 保留元数据标签
         str(dst)
     ]
-    
-    # 获取视频时长用于计算进度百分比
-    duration_cmd = [ffmpeg_bin, "-i", str(src)]
-    code, _, err = cmd_output(duration_cmd)
-    duration_sec = None
-    for line in err.split('\n'):
-        if 'Duration:' in line:
-            try:
-                time_str = line.split('Duration:')[1].split(',')[0].strip()
-                h, m, s = time_str.split(':')
-                duration_sec = int(h) * 3600 + int(m) * 60 + float(s)
-            except Exception:
-                pass
-            break
+    if threads > 0:
+        # 限制单个 ffmpeg 的线程数，避免多任务并行时过度抢占 CPU
+        cmd[-1:-1] = ["-threads", str(threads)]
     
     # 运行 ffmpeg 并解析进度
     try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        # 以字节块读取，避免逐行文本解码；进度条限频刷新，防止输出拖慢 ffmpeg
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         current_time = 0.0
-        for line in proc.stdout:
-            line = line.strip()
-            if line.startswith('out_time_ms='):
-                try:
-                    time_ms = int(line.split('=')[1])
-                    current_time = time_ms / 1000000.0
-                    if duration_sec and duration_sec > 0:
-                        progress = min(100, (current_time / duration_sec) * 100)
-                        bar_len = 40
-                        filled = int(bar_len * progress / 100)
-                        bar = '█' * filled + '░' * (bar_len - filled)
-                        print(f'\r[进度] {bar} {progress:.1f}% ({current_time:.1f}/{duration_sec:.1f}s)', end='', flush=True)
-                except Exception:
-                    pass
+        last_draw = 0.0
+        pending = b""
+        while True:
+            chunk = proc.stdout.read1(65536)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                # out_time_us 为新版字段；旧字段 out_time_ms 的数值实际也是微秒
+                if line.startswith(b'out_time_us=') or line.startswith(b'out_time_ms='):
+                    try:
+                        current_time = int(line[12:]) / 1000000.0
+                    except ValueError:
+                        pass
+            now = time.monotonic()
+            if show_progress and duration_sec and duration_sec > 0 and now - last_draw >= PROGRESS_INTERVAL:
+                last_draw = now
+                progress = min(100, (current_time / duration_sec) * 100)
+                bar_len = 40
+                filled = int(bar_len * progress / 100)
+                bar = '█' * filled + '░' * (bar_len - filled)
+                print(f'\r[进度] {bar} {progress:.1f}% ({current_time:.1f}/{duration_sec:.1f}s)', end='', flush=True)
         proc.wait()
-        if proc.returncode == 0 and duration_sec:
-            bar = '█' * 40
-            print(f'\r[进度] {bar} 100.0% ({duration_sec:.1f}/{duration_sec:.1f}s)')
-        elif proc.returncode == 0:
-            print()
+        if show_progress and proc.returncode == 0:
+            if duration_sec:
+                bar = '█' * 40
+                print(f'\r[进度] {bar} 100.0% ({duration_sec:.1f}/{duration_sec:.1f}s)')
+            else:
+                print()
+        if proc.returncode != 0 and hwaccel != "none":
+            # 硬件编码可能因并发会话数上限、分辨率或像素格式不受支持而失败，改用 libx265 重试一次
+            if show_progress:
+                print()
+            print(f"[WARN] {HW_ENCODERS[hwaccel]} 编码失败，改用 libx265 重试: {src.name}")
+            return convert_video_to_h265(src, dst, crf=crf, preset=preset, ffmpeg_bin=ffmpeg_bin, skip_h265=skip_h265, threads=threads, show_progress=show_progress, hwaccel="none")
         return proc.returncode == 0
     except FileNotFoundError:
         print(f"[NOT FOUND] Command not found: {cmd[0]}", file=sys.stderr)
         return False
 
 
-def should_skip(src: Path, dst: Path, overwrite: bool) -> bool:
-    if not dst.exists():
-        return False
-    if overwrite:
+# 输出目录索引：规范化路径 -> (mtime, 大小)。启动时扫描一次 out_root，之后用查表代替逐个 stat；
+# 为 None 时（未建立索引）退回直接访问文件系统
+_output_index: dict[str, tuple[float, int]] | None = None
+
+
+def index_output(root: Path) -> dict[str, tuple[float, int]]:
+    index: dict[str, tuple[float, int]] = {}
+    for entry, _ in iter_media(str(root), copy_others=True):
         try:
-            dst.unlink()
-        except Exception:
-            pass
+            st = entry.stat()
+        except OSError:
+            continue
+        index[os.path.normcase(entry.path)] = (st.st_mtime, st.st_size)
+    return index
+
+
+def set_output_index(index: dict[str, tuple[float, int]] | None) -> None:
+    """设置当前进程使用的输出索引（同时作为进程池的 initializer）"""
+    global _output_index
+    _output_index = index
+
+
+def lookup_output(dst: Path) -> tuple[float, int] | None:
+    if _output_index is None:
+        try:
+            st = dst.stat()
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+    return _output_index.get(os.path.normcase(str(dst)))
+
+
+def record_output(dst: Path) -> None:
+    """输出文件写入完成后同步更新索引"""
+    if _output_index is None:
+        return
+    try:
+        st = dst.stat()
+        _output_index[os.path.normcase(str(dst))] = (st.st_mtime, st.st_size)
+    except OSError:
+        forget_output(dst)
+
+
+def forget_output(dst: Path) -> None:
+    if _output_index is not None:
+        _output_index.pop(os.path.normcase(str(dst)), None)
+
+
+# 内容指纹缓存：f"{大小}:{前 1MB 的 blake2s}:{编码参数}" -> {源文件完整内容的 blake2s: {"path": 相对 out_root 的输出路径, "size": 输出文件大小}}
+# 前缀指纹只用于挑选候选，复用前还要比对完整内容的摘要
+_convert_cache: dict[str, dict] | None = None
+
+
+def set_convert_cache(cache: dict[str, dict] | None) -> None:
+    global _convert_cache
+    _convert_cache = cache
+
+
+def init_worker(output_index: dict[str, tuple[float, int]] | None, convert_cache: dict[str, dict] | None, probe_cache: dict | None = None) -> None:
+    """进程池 initializer：每个子进程只接收一次索引与缓存"""
+    set_output_index(output_index)
+    set_convert_cache(convert_cache)
+    if probe_cache:
+        _probe_cache.update(probe_cache)
+
+
+def restore_probe_cache(entries: list | None) -> None:
+    """恢复缓存文件中保存的视频探测结果，丢弃源文件已被修改的条目"""
+    for entry in entries or []:
+        try:
+            path, mtime, size, codec_name, duration_sec = entry
+            st = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            continue
+        if st.st_mtime == mtime and st.st_size == size:
+            _probe_cache[(path, mtime, size)] = (codec_name, duration_sec)
+
+
+def load_convert_cache(out_root: Path) -> dict[str, dict]:
+    """读取 out_root 下的指纹缓存，丢弃输出文件已不存在或大小不符的条目；同时恢复视频探测结果"""
+    try:
+        data = json.loads((out_root / CACHE_FILE).read_text(encoding="utf-8"))
+        restore_probe_cache(data.get("probes"))
+        # 旧版本的条目没有完整摘要，无法确认内容相同，直接丢弃
+        outputs = data.get("outputs", {}) if data.get("version") == CACHE_VERSION else {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+    cache: dict[str, dict] = {}
+    for key, candidates in outputs.items():
+        try:
+            for digest, entry in candidates.items():
+                existing = lookup_output(out_root / entry["path"])
+                if existing is not None and existing[1] == entry["size"]:
+                    cache.setdefault(key, {})[digest] = entry
+        except (AttributeError, KeyError, TypeError):
+            continue
+    return cache
+
+
+def merge_cache_entries(cache: dict[str, dict], entries: list[tuple[str, dict]]) -> None:
+    """把子进程返回的新条目合并进缓存，同一前缀指纹下的其他候选保留不变"""
+    for key, candidates in entries:
+        cache.setdefault(key, {}).update(candidates)
+
+
+def save_convert_cache(out_root: Path, cache: dict[str, dict]) -> None:
+    path = out_root / CACHE_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        # 探测结果以 [路径, mtime, 大小, 视频编码, 时长] 保存，下次运行（如 --dry-run 之后的正式转换）无需再次探测
+        probes = [[*key, *value] for key, value in _probe_cache.items()]
+        tmp.write_text(json.dumps({"version": CACHE_VERSION, "outputs": cache, "probes": probes}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[WARN] 无法写入缓存文件: {path} ({e})")
+
+
+def encode_settings(kind: int, args) -> str:
+    """影响输出内容的编码参数；参数不同时即使源文件相同也不能复用输出"""
+    if kind == KIND_IMAGE:
+        return f"heic:{args.image_crf}:{args.video_preset}:{getattr(args, 'heif_encoder', '')}"
+    return f"hevc:{args.video_crf}:{args.video_preset}:{getattr(args, 'hwaccel', 'none')}"
+
+
+def content_key(src: Path, size: int, settings: str = "") -> str | None:
+    """文件大小 + 文件头 1MB 的 blake2s + 编码参数作为内容指纹，无需读取整个文件"""
+    try:
+        with open(src, "rb") as f:
+            digest = hashlib.blake2s(f.read(HASH_PREFIX_BYTES)).hexdigest()
+    except OSError:
+        return None
+    return f"{size}:{digest}:{settings}"
+
+
+def full_digest(src: Path) -> str | None:
+    """源文件完整内容的 blake2s，用于确认前缀指纹相同的文件确实完全相同"""
+    h = hashlib.blake2s()
+    try:
+        with open(src, "rb") as f:
+            while chunk := f.read(HASH_PREFIX_BYTES):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def remember_output(key: str | None, src: Path, dst: Path, out_root: Path) -> list[tuple[str, dict]]:
+    """记录内容指纹对应的输出，返回新增条目供主进程汇总"""
+    existing = lookup_output(dst)
+    if key is None or existing is None:
+        return []
+    digest = full_digest(src)
+    if digest is None:
+        return []
+    candidates = {digest: {"path": dst.relative_to(out_root).as_posix(), "size": existing[1]}}
+    if _convert_cache is not None:
+        merge_cache_entries(_convert_cache, [(key, candidates)])
+    return [(key, candidates)]
+
+
+def reuse_cached_output(src: Path, src_stat: os.stat_result, dst: Path, in_root: Path, out_root: Path, overwrite: bool, settings: str = "") -> tuple[bool, str | None]:
+    """按内容指纹查找之前以相同编码参数转换过的相同文件，命中时直接复用其输出；返回 (是否复用, 指纹)"""
+    key = content_key(src, src_stat.st_size, settings)
+    # --overwrite 表示用户希望重新转换（例如更换了质量参数），不使用缓存
+    if key is None or overwrite or not _convert_cache or key not in _convert_cache:
+        return False, key
+    # 大小与文件头相同不代表内容相同（如 BMP 等未压缩格式），有候选时再比对完整内容
+    entry = _convert_cache[key].get(full_digest(src))
+    if entry is None:
+        return False, key
+    cached = out_root / entry["path"]
+    existing = lookup_output(cached)
+    if existing is None or existing[1] != entry["size"]:
+        return False, key
+    if os.path.normcase(str(cached)) != os.path.normcase(str(dst)):
+        # 不用硬链接：内容相同的源文件修改时间可能不同，输出需要各自的 mtime
+        try:
+            fast_copy(cached, dst)
+        except OSError as e:
+            print(f"[WARN] 复用已转换文件失败: {cached} -> {dst} ({e})")
+            return False, key
+    set_mtime_like_source(src, dst)
+    record_output(dst)
+    print(f"[CACHE] {src.relative_to(in_root)} -> {dst.relative_to(out_root)}")
+    return True, key
+
+
+def output_up_to_date(src: Path, dst: Path, src_stat: os.stat_result | None = None) -> bool:
+    """只读检查：输出已存在且不比源文件旧（不修改任何文件）"""
+    existing = lookup_output(dst)
+    if existing is None:
         return False
     # If destination exists and newer or same size, skip
     try:
-        s_stat = src.stat()
-        d_stat = dst.stat()
-        if d_stat.st_mtime >= s_stat.st_mtime and d_stat.st_size > 0:
+        s_stat = src_stat or src.stat()
+        d_mtime, d_size = existing
+        if d_mtime >= s_stat.st_mtime and d_size > 0:
             return True
     except Exception:
         return False
     return False
 
 
-def process_file(src: Path, in_root: Path, out_root: Path, args) -> None:
+def should_skip(src: Path, dst: Path, overwrite: bool, src_stat: os.stat_result | None = None) -> bool:
+    if lookup_output(dst) is None:
+        return False
+    if overwrite:
+        try:
+            dst.unlink()
+        except Exception:
+            pass
+        forget_output(dst)
+        return False
+    return output_up_to_date(src, dst, src_stat)
+
+
+# 单进程模式下，元数据复制与时间同步交给后台线程，与下一个文件的编码重叠进行
+_post_executor: ThreadPoolExecutor | None = None
+_post_futures: list[Future] = []
+
+
+def set_post_executor(executor: ThreadPoolExecutor | None) -> None:
+    global _post_executor
+    _post_executor = executor
+
+
+def drain_post_tasks() -> list[tuple[str, dict]]:
+    """等待所有后台收尾任务完成，汇总其新增的指纹缓存条目"""
+    entries: list[tuple[str, dict]] = []
+    while _post_futures:
+        entries += _post_futures.pop(0).result()
+    return entries
+
+
+def finalize_output(src: Path, kind: int, dst: Path, in_root: Path, out_root: Path, args, backend: str, cache_key: str | None = None) -> list[tuple[str, dict]]:
+    """转换成功后复制元数据并同步修改时间，返回新增的指纹缓存条目"""
+    if getattr(args, 'skip_convert', False):
+        print(f"[UPDATE] {dst.relative_to(out_root)} 的时间和元数据已更新")
+    else:
+        print(f"[OK] {src.relative_to(in_root)} -> {dst.relative_to(out_root)}")
+    if _post_executor is not None:
+        _post_futures.append(_post_executor.submit(write_output_metadata, src, kind, dst, out_root, args, backend, cache_key))
+        return []
+    return write_output_metadata(src, kind, dst, out_root, args, backend, cache_key)
+
+
+def write_output_metadata(src: Path, kind: int, dst: Path, out_root: Path, args, backend: str, cache_key: str | None = None) -> list[tuple[str, dict]]:
+    skip_convert = getattr(args, 'skip_convert', False)
+    # 处理元数据复制
+    if kind == KIND_IMAGE:
+        # 图片：若使用 magick / Wand / pillow-heif 则已迁移 EXIF；若是 skip 模式需要显式复制
+        if backend not in ('magick', 'wand', 'pillow'):
+            # rawpy 解码时已按相机方向旋转像素，不能再复制 Orientation
+            copy_image_exif(src, dst, getattr(args, 'exiftool', ''), keep_orientation=backend != 'rawpy')
+    elif kind == KIND_VIDEO:
+        # 视频：如果是 skip_convert 模式，需要使用 ffmpeg 复制元数据
+        if skip_convert:
+            ffmpeg_bin = getattr(args, 'ffmpeg', 'ffmpeg')
+            copy_video_metadata(src, dst, ffmpeg_bin)
+        # 否则转换时已通过 -map_metadata 复制了元数据
+
+    set_mtime_like_source(src, dst)
+    record_output(dst)
+    return remember_output(cache_key, src, dst, out_root)
+
+
+def process_file(source: SourceFile, in_root: Path, out_root: Path, args) -> list[tuple[str, dict]]:
+    src, kind, src_stat = source
     rel = src.relative_to(in_root)
     out_dir = out_root / rel.parent
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # 跳过转换模式:不复制不转换，仅更新元数据和时间
     skip_convert = getattr(args, 'skip_convert', False)
+    cache_key = None
     
-    if is_image(src):
+    if kind == KIND_IMAGE:
         out_ext = ".heic" if not skip_convert else src.suffix
         dst = out_dir / (src.stem + out_ext)
+        thumb = out_dir / (src.stem + THUMB_SUFFIX) if getattr(args, 'also_thumb', False) and not skip_convert else None
         
         # skip_convert 模式下的特殊处理
         if skip_convert:
             # 检查目标文件是否存在
-            if not dst.exists():
+            if lookup_output(dst) is None:
                 print(f"[ERR] 目标文件不存在，跳过: {dst}")
-                return
+                return []
             # 如果 overwrite=否，则不做任何操作
             if not args.overwrite:
                 print(f"[SKIP] {rel} (skip_convert 且 overwrite=否)")
-                return
+                return []
             # overwrite=是，继续更新元数据
             ok = True
             backend = 'skip'
         else:
             # 正常转换模式
-            if should_skip(src, dst, args.overwrite):
-                print(f"[SKIP] {rel} -> {dst.relative_to(out_root)}")
-                return
             ffmpeg_bin = getattr(args, 'ffmpeg', 'ffmpeg')
+            if should_skip(src, dst, args.overwrite, src_stat):
+                print(f"[SKIP] {rel} -> {dst.relative_to(out_root)}")
+                if thumb is not None:
+                    ensure_thumbnail(src, thumb, ffmpeg_bin)
+                return []
+            reused, cache_key = reuse_cached_output(src, src_stat, dst, in_root, out_root, args.overwrite, encode_settings(kind, args))
+            if reused:
+                if thumb is not None:
+                    ensure_thumbnail(src, thumb, ffmpeg_bin)
+                return []
             magick_bin = getattr(args, 'magick', 'magick')
-            ok, backend = convert_image_to_heic(src, dst, quality=args.image_crf, preset=args.video_preset, ffmpeg_bin=ffmpeg_bin, magick_bin=magick_bin)
-    elif is_video(src):
+            ok, backend = convert_image_to_heic(src, dst, quality=args.image_crf, preset=args.video_preset, ffmpeg_bin=ffmpeg_bin, magick_bin=magick_bin, heif_encoder=getattr(args, 'heif_encoder', ''), thumb=thumb)
+            if ok and thumb is not None and thumb.exists():
+                set_mtime_like_source(src, thumb)
+                record_output(thumb)
+    elif kind == KIND_VIDEO:
         # Normalize container to .mp4 for better compatibility
         out_ext = ".mp4" if not skip_convert else src.suffix
         dst = out_dir / (src.stem + out_ext)
@@ -321,58 +1184,48 @@ def process_file(src: Path, in_root: Path, out_root: Path, args) -> None:
         # skip_convert 模式下的特殊处理
         if skip_convert:
             # 检查目标文件是否存在
-            if not dst.exists():
+            if lookup_output(dst) is None:
                 print(f"[ERR] 目标文件不存在，跳过: {dst}")
-                return
+                return []
             # 如果 overwrite=否，则不做任何操作
             if not args.overwrite:
                 print(f"[SKIP] {rel} (skip_convert 且 overwrite=否)")
-                return
+                return []
             # overwrite=是，继续更新元数据
             ok = True
+            backend = 'skip'
         else:
             # 正常转换模式
-            if should_skip(src, dst, args.overwrite):
+            if should_skip(src, dst, args.overwrite, src_stat):
                 print(f"[SKIP] {rel} -> {dst.relative_to(out_root)}")
-                return
+                return []
+            reused, cache_key = reuse_cached_output(src, src_stat, dst, in_root, out_root, args.overwrite, encode_settings(kind, args))
+            if reused:
+                return []
             ffmpeg_bin = getattr(args, 'ffmpeg', 'ffmpeg')
-            ok = convert_video_to_h265(src, dst, crf=args.video_crf, preset=args.video_preset, ffmpeg_bin=ffmpeg_bin)
+            jobs = getattr(args, 'jobs', 1)
+            threads = getattr(args, 'threads_per_job', 0)
+            backend = 'ffmpeg'
+            ok = convert_video_to_h265(src, dst, crf=args.video_crf, preset=args.video_preset, ffmpeg_bin=ffmpeg_bin, threads=threads, show_progress=jobs == 1, hwaccel=getattr(args, 'hwaccel', 'none'))
     else:
         # Copy non-media files as-is or skip
         if args.copy_others:
             dst = out_dir / src.name
-            if should_skip(src, dst, args.overwrite):
+            if should_skip(src, dst, args.overwrite, src_stat):
                 print(f"[SKIP] {rel} (copy)")
-                return
+                return []
             try:
-                shutil.copy2(src, dst)
+                fast_copy(src, dst)
+                record_output(dst)
                 print(f"[COPY] {rel} -> {dst.relative_to(out_root)}")
             except Exception as e:
                 print(f"[ERR] copy failed: {src} -> {dst}: {e}")
-            return
+            return []
         else:
-            return
+            return []
 
     if ok:
-        # 处理元数据复制
-        if is_image(src):
-            # 图片：若使用 magick 则已迁移 EXIF；若是 skip 模式需要显式复制
-            if 'backend' in locals() and backend == 'magick':
-                pass
-            else:
-                copy_image_exif(src, dst)
-        elif is_video(src):
-            # 视频：如果是 skip_convert 模式，需要使用 ffmpeg 复制元数据
-            if skip_convert:
-                ffmpeg_bin = getattr(args, 'ffmpeg', 'ffmpeg')
-                copy_video_metadata(src, dst, ffmpeg_bin)
-            # 否则转换时已通过 -map_metadata 复制了元数据
-        
-        set_mtime_like_source(src, dst)
-        if skip_convert:
-            print(f"[UPDATE] {dst.relative_to(out_root)} 的时间和元数据已更新")
-        else:
-            print(f"[OK] {rel} -> {dst.relative_to(out_root)}")
+        return finalize_output(src, kind, dst, in_root, out_root, args, backend, cache_key)
     else:
         # Clean up partials
         try:
@@ -380,17 +1233,208 @@ def process_file(src: Path, in_root: Path, out_root: Path, args) -> None:
                 dst.unlink()
         except Exception:
             pass
+        forget_output(dst)
         print(f"[FAIL] {rel}")
+        return []
+
 
+def process_image_batch(sources: list[SourceFile], in_root: Path, out_root: Path, args) -> list[tuple[str, dict]]:
+    """同一目录下的一组图片用一条命令转换；批量失败的图片再逐个转换"""
+    out_dir = out_root / sources[0].path.parent.relative_to(in_root)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
-def gather_files(in_root: Path) -> list[Path]:
-    files: list[Path] = []
-    for p in in_root.rglob('*'):
-        if p.is_file():
-            files.append(p)
+    pending: list[SourceFile] = []
+    cache_keys: dict[Path, str | None] = {}
+    for source in sources:
+        src = source.path
+        dst = out_dir / (src.stem + ".heic")
+        if should_skip(src, dst, args.overwrite, source.stat):
+            print(f"[SKIP] {src.relative_to(in_root)} -> {dst.relative_to(out_root)}")
+            continue
+        reused, cache_keys[src] = reuse_cached_output(src, source.stat, dst, in_root, out_root, args.overwrite, encode_settings(KIND_IMAGE, args))
+        if reused:
+            continue
+        # 先删除过期的旧输出，之后以文件是否生成判断每张图片是否成功
+        if lookup_output(dst) is not None:
+            try:
+                dst.unlink()
+            except Exception:
+                pass
+            forget_output(dst)
+        pending.append(source)
+    if not pending:
+        return []
+
+    ffmpeg_bin = getattr(args, 'ffmpeg', 'ffmpeg')
+    magick_bin = getattr(args, 'magick', 'magick')
+    backend, failed = convert_images_to_heic([source.path for source in pending], out_dir, quality=args.image_crf, preset=args.video_preset, ffmpeg_bin=ffmpeg_bin, magick_bin=magick_bin)
+    new_entries: list[tuple[str, dict]] = []
+    for source in pending:
+        src = source.path
+        dst = out_dir / (src.stem + ".heic")
+        try:
+            ok = backend != "none" and src not in failed and dst.stat().st_size > 0
+        except OSError:
+            ok = False
+        if ok:
+            new_entries += finalize_output(src, KIND_IMAGE, dst, in_root, out_root, args, backend, cache_keys.get(src))
+        else:
+            # 所在批次命令失败时输出可能不完整，删除后逐个重新转换
+            try:
+                if dst.exists():
+                    dst.unlink()
+            except Exception:
+                pass
+            new_entries += process_file(source, in_root, out_root, args)
+    return new_entries
+
+
+def plan_tasks(files: list[SourceFile], args) -> list[tuple]:
+    """将文件拆分为任务：图片按所在目录分组批量转换，其余文件逐个处理"""
+    # 可在进程内编码时逐个处理即可，无需批量调用外部程序；指定了编码器插件或需要缩略图时 magick mogrify 无法使用
+    if getattr(args, 'skip_convert', False) or inproc_heic_available() or getattr(args, 'heif_encoder', '') or getattr(args, 'also_thumb', False):
+        return [(process_file, f) for f in files]
+    groups: dict[Path, list[SourceFile]] = {}
+    tasks: list[tuple] = []
+    for f in files:
+        if f.kind == KIND_IMAGE:
+            groups.setdefault(f.path.parent, []).append(f)
+        else:
+            tasks.append((process_file, f))
+    jobs = max(1, getattr(args, 'jobs', 1))
+    for srcs in groups.values():
+        # 并行时将大目录拆成至少 jobs 份，保证各进程都有活干
+        size = max(1, -(-len(srcs) // jobs))
+        for i in range(0, len(srcs), size):
+            tasks.append((process_image_batch, srcs[i:i + size]))
+    return tasks
+
+
+def iter_media(root: str, copy_others: bool = False) -> Iterator[tuple[os.DirEntry, int]]:
+    """用 os.scandir 递归遍历目录，产出 (DirEntry, 文件类别)；仅含媒体文件（copy_others 时含全部文件）"""
+    try:
+        it = os.scandir(root)
+    except OSError as e:
+        print(f"[WARN] 无法读取目录: {root} ({e})")
+        return
+    with it:
+        for entry in it:
+            try:
+                # 不跟随目录符号链接，避免循环；DirEntry 自带文件类型，普通文件无需额外 stat
+                if entry.is_dir(follow_symlinks=False):
+                    yield from iter_media(entry.path, copy_others)
+                elif entry.is_file():
+                    kind = EXT_KIND.get(os.path.splitext(entry.name)[1].lower(), KIND_OTHER)
+                    if copy_others or kind != KIND_OTHER:
+                        yield entry, kind
+            except OSError:
+                continue
+
+
+def gather_files(in_root: Path, copy_others: bool = False) -> list[SourceFile]:
+    files: list[SourceFile] = []
+    for entry, kind in iter_media(str(in_root), copy_others):
+        try:
+            files.append(SourceFile(Path(entry.path), kind, entry.stat()))
+        except OSError:
+            continue
     return files
 
 
+def sample_encode_speed(src: Path, duration_sec: float | None, args) -> float | None:
+    """用与正式转换相同的编码参数试编码视频开头几秒，返回编码速度（视频秒数 / 实际耗时）"""
+    threads = getattr(args, 'threads_per_job', 0)
+    pre_args, enc_args = video_encoder_args(getattr(args, 'hwaccel', 'none'), args.video_crf, args.video_preset, threads)
+    cmd = [
+        args.ffmpeg, "-v", "error",
+        *pre_args,
+        "-t", str(SAMPLE_ENCODE_SEC),
+        "-i", str(src),
+        "-an",
+        *enc_args,
+        "-f", "null", "-"
+    ]
+    if threads > 0:
+        cmd[-3:-3] = ["-threads", str(threads)]
+    start = time.monotonic()
+    code, _, _ = cmd_output(cmd, capture_stdout=False, capture_stderr=False)
+    elapsed = time.monotonic() - start
+    if code != 0 or elapsed <= 0:
+        return None
+    sampled = min(SAMPLE_ENCODE_SEC, duration_sec) if duration_sec else SAMPLE_ENCODE_SEC
+    return sampled / elapsed
+
+
+def dry_run(files: list[SourceFile], in_root: Path, out_root: Path, args) -> None:
+    """只打印计划的输出路径，并根据视频总时长与试编码速度估算转换耗时，不写入任何输出文件"""
+    skip_convert = getattr(args, 'skip_convert', False)
+    n_images = n_videos = n_h265 = n_copies = n_skipped = 0
+    total_duration = 0.0
+    unknown_duration = 0
+    sample: tuple[Path, float | None] | None = None
+    for src, kind, src_stat in files:
+        rel = src.relative_to(in_root)
+        if kind == KIND_IMAGE:
+            dst = out_root / rel.parent / (src.stem + (src.suffix if skip_convert else ".heic"))
+        elif kind == KIND_VIDEO:
+            dst = out_root / rel.parent / (src.stem + (src.suffix if skip_convert else ".mp4"))
+        else:
+            dst = out_root / rel
+        if skip_convert and kind != KIND_OTHER:
+            if lookup_output(dst) is None or not args.overwrite:
+                n_skipped += 1
+                print(f"[SKIP] {rel}")
+            else:
+                print(f"[PLAN] {rel} -> {dst.relative_to(out_root)} (仅更新元数据)")
+            continue
+        # 只做只读检查：--overwrite 时视为将重新转换，但不删除已有输出
+        if not args.overwrite and output_up_to_date(src, dst, src_stat):
+            n_skipped += 1
+            print(f"[SKIP] {rel} -> {dst.relative_to(out_root)}")
+            continue
+        if kind == KIND_IMAGE:
+            n_images += 1
+            print(f"[PLAN] {rel} -> {dst.relative_to(out_root)}")
+        elif kind == KIND_VIDEO:
+            codec_name, duration_sec = probe_video(src, args.ffmpeg)
+            if codec_name in ("hevc", "h265"):
+                n_h265 += 1
+                print(f"[PLAN] {rel} -> {dst.relative_to(out_root)} (已是 H.265，直接复制)")
+                continue
+            n_videos += 1
+            if duration_sec:
+                total_duration += duration_sec
+            else:
+                unknown_duration += 1
+            if sample is None:
+                sample = (src, duration_sec)
+            print(f"[PLAN] {rel} -> {dst.relative_to(out_root)} ({duration_sec or 0:.1f}s)")
+        else:
+            n_copies += 1
+            print(f"[PLAN] {rel} -> {dst.relative_to(out_root)} (复制)")
+
+    print(f"[INFO] 计划：转换 {n_images} 张图片、{n_videos} 个视频（总时长 {timedelta(seconds=int(total_duration))}），"
+          f"直接复制 {n_h265} 个 H.265 视频与 {n_copies} 个其他文件，跳过 {n_skipped} 个")
+    if unknown_duration:
+        print(f"[WARN] {unknown_duration} 个视频无法获取时长，未计入估算。")
+    if sample is None or total_duration <= 0:
+        return
+    print(f"[INFO] 试编码 {sample[0].name} 的前 {SAMPLE_ENCODE_SEC} 秒以测量编码速度...")
+    speed = sample_encode_speed(sample[0], sample[1], args)
+    if not speed:
+        print("[WARN] 试编码失败，无法估算耗时。")
+        return
+    if getattr(args, 'hwaccel', 'none') == "none":
+        # 各任务按 threads_per_job 平分 CPU，近似认为总吞吐随并行任务数线性增长
+        parallel = min(args.jobs, n_videos)
+        eta = total_duration / speed / parallel
+        print(f"[INFO] 编码速度约 {speed:.2f}x，{parallel} 个并行任务下预计视频转换耗时约 {timedelta(seconds=int(eta))}")
+    else:
+        # 所有任务共用同一个硬件编码器（且有并发会话数上限），吞吐不随 --jobs 增长，按单个编码器估算
+        eta = total_duration / speed
+        print(f"[INFO] 编码速度约 {speed:.2f}x，预计视频转换耗时约 {timedelta(seconds=int(eta))}（按单个硬件编码器 {HW_ENCODERS[args.hwaccel]} 估算，不随 --jobs 缩短）")
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Convert images to HEIC and videos to H.265, preserve mtime, copy EXIF.")
     parser.add_argument("input", type=str, nargs="?", help="Input directory (source)")
@@ -401,6 +1445,12 @@ def parse_args():
     parser.add_argument("--video-preset", type=str, default="medium", help="H.265 preset (ultrafast..veryslow)")
     parser.add_argument("--copy-others", action="store_true", help="Copy non-media files as-is")
     parser.add_argument("--skip-convert", action="store_true", help="Skip conversion, only update mtime and metadata")
+    parser.add_argument("--hwaccel", type=str, default="auto", choices=HWACCEL_CHOICES, help="H.265 hardware encoder (auto detects NVENC/QSV/AMF/VAAPI, none = libx265)")
+    parser.add_argument("--also-thumb", action="store_true", help=f"Also write a JPEG thumbnail (<stem>{THUMB_SUFFIX}, max {THUMB_WIDTH}px wide) next to each HEIC")
+    parser.add_argument("--dry-run", action="store_true", help="Only print planned outputs and estimate video encode time; no outputs are written (only the probe cache in an existing output directory is updated)")
+    parser.add_argument("--heif-encoder", type=str, default="", help="libheif HEIC encoder plugin, e.g. kvazaar or x265 (see heif-enc --list-encoders; default: libheif default)")
+    parser.add_argument("--jobs", type=int, default=default_jobs(), help="Number of files converted in parallel (default: CPU cores / 4)")
+    parser.add_argument("--threads-per-job", type=int, default=0, help="Threads per ffmpeg/x265 job (default: CPU cores / jobs)")
     return parser.parse_args()
 
 
@@ -454,9 +1504,11 @@ def interactive_prompt(args):
     image_crf = prompt_int("图片 CRF (质量，数字越低质量越好)", args.image_crf)
     video_crf = prompt_int("视频 CRF", args.video_crf)
     video_preset = prompt_choice("视频编码预设", ["ultrafast","superfast","veryfast","faster","fast","medium","slow","slower","veryslow"], args.video_preset)
+    hwaccel = prompt_choice("视频硬件编码 (auto 自动检测，none 使用 CPU)", HWACCEL_CHOICES, args.hwaccel)
     overwrite = prompt_bool("是否覆盖已存在的输出文件", args.overwrite)
     copy_others = prompt_bool("是否复制非媒体文件", args.copy_others)
     skip_convert = prompt_bool("是否跳过转换,仅修改时间和元数据", args.skip_convert)
+    jobs = prompt_int("并行处理的文件数", args.jobs)
 
     # 仅在不可用时才询问路径：ffmpeg
     ffmpeg_default = os.environ.get("FFMPEG_PATH", "")
@@ -470,8 +1522,7 @@ def interactive_prompt(args):
         ffmpeg_path_input = ffmpeg_path_input or ffmpeg_default or ""
     
     # 根据源目录内容，按需询问图片相关工具
-    in_root_tmp = Path(in_dir)
-    has_images = any(is_image(p) for p in in_root_tmp.rglob('*') if p.is_file())
+    has_images = any(kind == KIND_IMAGE for _, kind in iter_media(in_dir))
     if has_images:
         # 先检测 magick；若可用则无需 exiftool 询问（magick 会保留 EXIF）
         magick_default = os.environ.get("MAGICK_PATH", "")
@@ -509,9 +1560,11 @@ def interactive_prompt(args):
     args.image_crf = image_crf
     args.video_crf = video_crf
     args.video_preset = video_preset
+    args.hwaccel = hwaccel
     args.overwrite = overwrite
     args.copy_others = copy_others
     args.skip_convert = skip_convert
+    args.jobs = jobs
     args.ffmpeg = ffmpeg_path_input
     args.exiftool = exiftool_path_input
     args.magick = magick_path_input
@@ -560,14 +1613,31 @@ def main():
     if not in_root.exists() or not in_root.is_dir():
         print(f"[ERR] Input directory not found: {in_root}")
         sys.exit(2)
-    out_root.mkdir(parents=True, exist_ok=True)
+    # 新建的输出目录无需扫描；否则一次性建立已有输出的索引
+    if out_root.exists():
+        set_output_index(index_output(out_root))
+    else:
+        set_output_index({})
+    dry = getattr(args, 'dry_run', False)
+    if not dry:
+        out_root.mkdir(parents=True, exist_ok=True)
+    set_convert_cache(load_convert_cache(out_root))
 
     # 先收集文件列表，再按需询问 exiftool（避免未定义变量）
-    files = gather_files(in_root)
-    # 仅在确实需要时才询问 exiftool：当存在图片且 magick 不可用时
+    files = gather_files(in_root, args.copy_others)
+    # 仅在确实需要时才询问 exiftool：当存在图片且 magick 不可用时（pillow-heif 可保留非 RAW 图片的 EXIF）
     exiftool_bin = (getattr(args, 'exiftool', '') or os.environ.get("EXIFTOOL_PATH", '') or "exiftool").strip()
-    has_images = any(is_image(f) for f in files)
-    if has_images and not ensure_tool_available("magick", magick_bin if magick_bin != "magick" else None):
+    has_images = any(f.kind == KIND_IMAGE for f in files)
+    has_raw = any(f.kind == KIND_IMAGE and f.path.suffix.lower() in RAW_EXTS for f in files)
+    if not getattr(args, 'skip_convert', False) and has_images and getattr(args, 'heif_encoder', ''):
+        args.heif_encoder = resolve_heif_encoder(args.heif_encoder)
+        if args.heif_encoder:
+            print(f"[INFO] HEIC 编码器插件: {args.heif_encoder}")
+    # 指定的编码器插件仅 heif-enc 提供时，图片会交给 heif-enc，EXIF 需要 exiftool 复制
+    heif_enc_only = bool(getattr(args, 'heif_encoder', '')) and args.heif_encoder not in pillow_heif_encoders()
+    # RAW 优先由 rawpy 解码，像素不带元数据，即使安装了 magick 也需要 exiftool
+    raw_via_rawpy = has_raw and pillow_heif is not None and rawpy is not None
+    if has_images and (heif_enc_only or raw_via_rawpy or ((pillow_heif is None or has_raw) and not wand_supports_heic() and not ensure_tool_available("magick", magick_bin if magick_bin != "magick" else None))):
         if not ensure_tool_available("exiftool", exiftool_bin if exiftool_bin != "exiftool" else None):
             print("[WARN] exiftool 未找到。将尝试询问路径；若仍不可用，则跳过 EXIF 复制。")
             while True:
@@ -588,8 +1658,7 @@ def main():
                     print("[ERR] 提供的路径不可用，请重试。")
 
     # 若存在图片且 magick 不可用,允许循环输入 magick 路径或直接使用回退
-    has_images = any(is_image(f) for f in files)
-    if has_images and not ensure_tool_available("magick", magick_bin if magick_bin != "magick" else None):
+    if has_images and not inproc_heic_available() and not ensure_tool_available("magick", magick_bin if magick_bin != "magick" else None):
         print("[INFO] 未检测到可用的 ImageMagick (magick)。可提供路径获得更佳 HEIC 编码；直接回车使用 heif-enc 或 ffmpeg 回退。")
         while True:
             try:
@@ -609,10 +1678,52 @@ def main():
     # 将路径保存在 args 供 process_file 内部使用
     args.ffmpeg = ffmpeg_bin
     args.magick = magick_bin
+    # 仅在确实需要转换视频时检测硬件编码器
+    if not getattr(args, 'skip_convert', False) and any(f.kind == KIND_VIDEO for f in files):
+        args.hwaccel = resolve_hwaccel(ffmpeg_bin, args.hwaccel)
+        print(f"[INFO] 视频编码器: {HW_ENCODERS.get(args.hwaccel, 'libx265')}")
+    # 按并行任务数平分 CPU 核心，作为每个 ffmpeg 的线程上限
+    args.jobs = max(1, args.jobs)
+    if getattr(args, 'threads_per_job', 0) <= 0:
+        args.threads_per_job = max(1, (os.cpu_count() or 1) // args.jobs)
+
+    if dry:
+        # 输出目录已存在时保存探测结果，正式运行时无需再次探测；不创建输出目录
+        dry_run(files, in_root, out_root, args)
+        if out_root.exists():
+            save_convert_cache(out_root, _convert_cache)
+        return
 
     # 修改 process_file 调用逻辑以传递路径（通过 args 内属性）
-    for f in files:
-        process_file(f, in_root, out_root, args)
+    tasks = plan_tasks(files, args)
+    new_entries: list[tuple[str, dict]] = []
+    try:
+        if args.jobs == 1 or len(tasks) <= 1:
+            # 单进程时用后台线程重叠各阶段：预先探测下一个视频，并在编码当前文件时完成上一个文件的收尾
+            with ThreadPoolExecutor(max_workers=1) as prefetch, ThreadPoolExecutor(max_workers=1) as post:
+                set_post_executor(post)
+                try:
+                    for i, (func, item) in enumerate(tasks):
+                        if i + 1 < len(tasks) and not args.skip_convert:
+                            next_func, next_item = tasks[i + 1]
+                            if next_func is process_file and next_item.kind == KIND_VIDEO:
+                                prefetch.submit(probe_video, next_item.path, args.ffmpeg)
+                        new_entries += func(item, in_root, out_root, args)
+                finally:
+                    set_post_executor(None)
+                    new_entries += drain_post_tasks()
+        else:
+            # 多进程并行处理；进度条在并行时会互相覆盖，因此仅在单任务时显示
+            print(f"[INFO] 使用 {args.jobs} 个并行任务，每个 ffmpeg 最多 {args.threads_per_job} 线程")
+            with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(_output_index, _convert_cache, _probe_cache)) as executor:
+                futures = [executor.submit(func, item, in_root, out_root, args) for func, item in tasks]
+                for future in futures:
+                    new_entries += future.result()
+    finally:
+        # 中断时也保存已完成部分的指纹，下次运行可直接复用
+        if new_entries or _probe_cache or (out_root / CACHE_FILE).exists():
+            merge_cache_entries(_convert_cache, new_entries)
+            save_convert_cache(out_root, _convert_cache)
 
 
 if __name__ == "__main__":